@@ -30,27 +30,60 @@ Example:
     - Run a list of zipped Mobly packages (built from `python_test_host`)
     local_mobly_runner.py -p test_pkg1,test_pkg2,test_pkg3
 
+    - Run a list of Mobly packages concurrently with a custom config, logging
+      to separate dirs
+    local_mobly_runner.py -p pkg1,pkg2 -c config.yaml -lp /tmp/logs --parallel
+
 Please run `local_mobly_runner.py -h` for a full list of options.
 """
 
 import argparse
+from concurrent import futures
+import contextlib
+import hashlib
 import json
 import os
 import platform
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
-from typing import List, Optional, Tuple
+from typing import IO, Iterator, List, Optional, Set, Tuple
 import zipfile
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 _LOCAL_SETUP_INSTRUCTIONS = (
     '\n\tcd <repo_root>; set -a; source build/envsetup.sh; set +a; lunch'
     ' <target>'
 )
 
-_tempdirs = []
-_tempfiles = []
+# Cap on concurrent per-device installs, to avoid overloading the adb server.
+_MAX_INSTALL_WORKERS = 8
+
+# adb error output indicating that a command is not supported by the host's
+# platform-tools or by the device.
+_UNSUPPORTED_COMMAND_MARKERS = ('unknown command', 'not supported',
+                                'unsupported')
+
+# Directory under $ANDROID_PRODUCT_OUT for caching `outmod` results.
+_OUTMOD_CACHE_DIR = '.local_mobly_runner_outmod_cache'
+
+# Files extracted from test packages for use by the runner.
+_PACKAGE_RESOURCE_SUFFIXES = ('requirements.txt', '.apk')
+
+# Directory for virtualenvs reused across runs, keyed by their requirements.
+_VENV_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'mobly_runner')
+# Marker file written once a cached virtualenv is fully set up.
+_VENV_READY_FILE = '.mobly_runner_ready'
+# Matches -r/-c lines including other files in a requirements file.
+_REQUIREMENTS_INCLUDE_PATTERN = re.compile(
+    r'\s*(?:-r|-c|--requirement|--constraint)[\s=]*(\S+)')
 
 
 def _padded_print(line: str) -> None:
@@ -117,11 +150,48 @@ def _parse_args() -> argparse.Namespace:
             'virtualenv.'
         ),
     )
+    parser.add_argument(
+        '--novenv_cache',
+        action='store_true',
+        help=(
+            'Create a fresh temporary virtualenv instead of reusing a cached '
+            'one with the same requirements.'
+        ),
+    )
+    parser.add_argument(
+        '--refresh_venv_cache',
+        action='store_true',
+        help=(
+            'Rebuild the cached virtualenv for the test requirements, e.g. to '
+            'pick up new versions of unpinned dependencies or changes to local '
+            'packages they refer to.'
+        ),
+    )
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help=(
+            'Run the Mobly tests concurrently instead of one after another. '
+            'All tests use the same config, so only use this if that config '
+            'allows the tests to run at the same time. Requires the --config '
+            'and --log_path options.'
+        ),
+    )
     args = parser.parse_args()
     if args.build and not args.module:
         parser.error('Option --build requires --module to be specified.')
     if args.install_apks and not (args.module or args.packages):
         parser.error('Option --install_apks requires --module or --packages.')
+    if args.refresh_venv_cache and (args.novenv or args.novenv_cache):
+        parser.error(
+            'Option --refresh_venv_cache cannot be used with --novenv or '
+            '--novenv_cache.'
+        )
+    if args.parallel and not (args.config and args.log_path):
+        parser.error(
+            'Option --parallel requires --config and --log_path to be '
+            'specified.'
+        )
 
     args.novenv = args.novenv or (args.test_paths is not None)
     return args
@@ -145,48 +215,133 @@ def _build_module(module: str) -> None:
         exit(1)
 
 
-def _get_module_artifacts(module: str) -> List[str]:
-    """Return the list of artifacts generated from a module."""
+def _get_outmod_cache_path(module: str) -> Optional[str]:
+    """Return the cache file path for the `outmod` output of a module.
+
+    The cache is keyed by the module name and the modification time of the
+    product's module-info.json, so it is invalidated whenever the module list
+    is regenerated.
+
+    Returns:
+      The cache file path, or None if the product out dir is not set up.
+    """
+    product_out = os.environ.get('ANDROID_PRODUCT_OUT')
+    if not product_out:
+        return None
     try:
-        outmod_paths = (
-            subprocess.check_output(
-                f'outmod {module}', shell=True, executable='/bin/bash'
-            )
-            .decode('utf-8')
-            .splitlines()
-        )
-    except subprocess.CalledProcessError as e:
-        if e.returncode == 127:
+        mtime_ns = os.stat(
+            os.path.join(product_out, 'module-info.json')).st_mtime_ns
+    except OSError:
+        return None
+    key = hashlib.sha256(f'{module}:{mtime_ns}'.encode('utf-8')).hexdigest()
+    return os.path.join(product_out, _OUTMOD_CACHE_DIR, f'{key}.json')
+
+
+def _read_outmod_cache(cache_path: Optional[str]) -> Optional[List[str]]:
+    """Read cached `outmod` output, if present and all its files exist."""
+    if cache_path is None or not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path) as f:
+            outmod_paths = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not all(os.path.isfile(path) for path in outmod_paths):
+        return None
+    return outmod_paths
+
+
+def _write_outmod_cache(
+        cache_path: Optional[str], outmod_paths: List[str]
+) -> None:
+    """Write `outmod` output to the cache."""
+    if cache_path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump(outmod_paths, f)
+    except OSError as e:
+        print(f'Failed to cache module artifacts at {cache_path}: {e}')
+
+
+def _run_outmod(module: str) -> List[str]:
+    """Return the list of artifacts of a module, as reported by `outmod`.
+
+    The output of `outmod` is streamed, so that each artifact is checked for
+    existence while `outmod` is still running.
+    """
+    outmod_paths = []
+    missing_paths = []
+    with subprocess.Popen(
+            f'outmod {module}', shell=True, executable='/bin/bash',
+            stdout=subprocess.PIPE, text=True
+    ) as proc:
+        for line in proc.stdout:
+            path = line.rstrip('\n')
+            if not path:
+                continue
+            outmod_paths.append(path)
+            if not os.path.isfile(path):
+                missing_paths.append(path)
+
+    if proc.returncode != 0:
+        if proc.returncode == 127:
             # `outmod` command not found
             print(
                 '`outmod` command not found. Please set up your local '
                 f'environment with {_LOCAL_SETUP_INSTRUCTIONS}.'
             )
-        if str(e.output).startswith('Could not find module'):
+        if outmod_paths and outmod_paths[0].startswith('Could not find module'):
             print(
                 f'Cannot find the build output of module {module}. Ensure that '
                 'the module list is up-to-date with `refreshmod`.'
             )
         exit(1)
 
-    for path in outmod_paths:
-        if not os.path.isfile(path):
-            print(
-                f'Declared file {path} does not exist. Please build your '
-                'module with the -b option.'
-            )
-            exit(1)
+    if missing_paths:
+        for path in missing_paths:
+            print(f'Declared file {path} does not exist.')
+        print('Please build your module with the -b option.')
+        exit(1)
+
+    return outmod_paths
 
+
+def _get_module_artifacts(module: str) -> List[str]:
+    """Return the list of artifacts generated from a module."""
+    cache_path = _get_outmod_cache_path(module)
+    outmod_paths = _read_outmod_cache(cache_path)
+    if outmod_paths is None:
+        outmod_paths = _run_outmod(module)
+        _write_outmod_cache(cache_path, outmod_paths)
     return outmod_paths
 
 
+def _unzip_package(package: str, unzip_dir: str) -> None:
+    """Extracts the test resources of a package to the given directory.
+
+    Only top-level requirements.txt and APK files are extracted; the rest of
+    the package is run directly from the zip.
+    """
+    print(f'Unzipping test package {package} to {unzip_dir}.')
+    os.makedirs(unzip_dir)
+    with zipfile.ZipFile(package) as zf:
+        for info in zf.infolist():
+            if ('/' not in info.filename
+                    and info.filename.endswith(_PACKAGE_RESOURCE_SUFFIXES)):
+                zf.extract(info, unzip_dir)
+
+
 def _resolve_test_resources(
         args: argparse.Namespace,
+        exit_stack: contextlib.ExitStack,
 ) -> Tuple[List[str], List[str], List[str]]:
     """Resolve test resources from the given test module or package.
 
     Args:
       args: Parsed command-line args.
+      exit_stack: ExitStack that owns any temporary directories created.
 
     Returns:
       Tuple of (mobly_bins, requirement_files, test_apks).
@@ -200,59 +355,175 @@ def _resolve_test_resources(
     elif args.module:
         print(f'Resolving test module {args.module}.')
         for path in _get_module_artifacts(args.module):
-            if path.endswith(args.module):
-                mobly_bins.append(path)
-            if path.endswith('requirements.txt'):
-                requirements_files.append(path)
             if path.endswith('.apk'):
                 test_apks.append(path)
+            elif path.endswith('requirements.txt'):
+                requirements_files.append(path)
+            elif path.endswith(args.module):
+                mobly_bins.append(path)
     elif args.packages:
-        unzip_root = tempfile.mkdtemp(prefix='mobly_unzip_')
-        _tempdirs.append(unzip_root)
-        for package in args.packages.split(','):
-            mobly_bins.append(os.path.abspath(package))
-            unzip_dir = os.path.join(unzip_root, os.path.basename(package))
-            print(f'Unzipping test package {package} to {unzip_dir}.')
-            os.makedirs(unzip_dir)
-            with zipfile.ZipFile(package) as zf:
-                zf.extractall(unzip_dir)
+        unzip_root = exit_stack.enter_context(
+            tempfile.TemporaryDirectory(prefix='mobly_unzip_'))
+        packages = args.packages.split(',')
+        mobly_bins.extend(os.path.abspath(package) for package in packages)
+        unzip_dirs = [
+            os.path.join(unzip_root, os.path.basename(package))
+            for package in packages
+        ]
+        max_workers = min(len(packages), os.cpu_count() or 1)
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_unzip_package, packages, unzip_dirs))
+        for unzip_dir in unzip_dirs:
             for path in os.listdir(unzip_dir):
                 path = os.path.join(unzip_dir, path)
-                if path.endswith('requirements.txt'):
-                    requirements_files.append(path)
                 if path.endswith('.apk'):
                     test_apks.append(path)
+                elif path.endswith('requirements.txt'):
+                    requirements_files.append(path)
     else:
         print('No tests specified. Aborting.')
         exit(1)
     return mobly_bins, requirements_files, test_apks
 
 
-def _setup_virtualenv(requirements_files: List[str]) -> str:
+def _setup_virtualenv(
+        requirements_files: List[str],
+        exit_stack: contextlib.ExitStack,
+        use_cache: bool = True,
+        refresh_cache: bool = False,
+) -> str:
     """Creates a virtualenv and install dependencies into it.
 
+    If use_cache is set, the virtualenv is created in a persistent cache dir
+    keyed by the host Python and the contents of the requirements files, and
+    reused by later runs with the same requirements. Where supported, lock
+    files serialize concurrent builds of the same virtualenv, and keep it from
+    being rebuilt while other runs are using it.
+
     Args:
       requirements_files: List of paths of requirements.txt files.
+      exit_stack: ExitStack that owns the virtualenv directory if it is not
+        cached, or the lock held while the cached virtualenv is in use.
+      use_cache: Whether to use the virtualenv cache.
+      refresh_cache: Whether to rebuild the cached virtualenv even if one
+        already exists.
 
     Returns:
       Path to the virtualenv's Python interpreter.
     """
-    venv_dir = tempfile.mkdtemp(prefix='venv_')
+    if not use_cache:
+        venv_dir = exit_stack.enter_context(
+            tempfile.TemporaryDirectory(prefix='venv_'))
+        _create_virtualenv(venv_dir, requirements_files)
+        return _get_venv_executable(venv_dir)
+
+    venv_dir = os.path.join(
+        _VENV_CACHE_DIR, f'venv_{_hash_requirements(requirements_files)}')
+    ready_file = os.path.join(venv_dir, _VENV_READY_FILE)
+    os.makedirs(_VENV_CACHE_DIR, exist_ok=True)
+    in_use_lock = exit_stack.enter_context(open(f'{venv_dir}.in_use.lock', 'a'))
+    with open(f'{venv_dir}.lock', 'a') as build_lock:
+        _lock_file(build_lock, exclusive=True)
+        if refresh_cache or not os.path.isfile(ready_file):
+            if refresh_cache:
+                # Wait for runs still using the virtualenv to finish
+                _lock_file(in_use_lock, exclusive=True)
+            # Discard the previous virtualenv, or one left incomplete by a
+            # failed run
+            if os.path.exists(venv_dir):
+                shutil.rmtree(venv_dir)
+            _create_virtualenv(venv_dir, requirements_files)
+            with open(ready_file, 'w'):
+                pass
+        else:
+            _padded_print(f'Reusing cached virtualenv at {venv_dir}.')
+        # Hold a shared lock while the virtualenv is in use, so that it is not
+        # rebuilt under a running test
+        _lock_file(in_use_lock, exclusive=False)
+    return _get_venv_executable(venv_dir)
+
+
+def _lock_file(f: IO[str], exclusive: bool) -> None:
+    """Blocks until an exclusive or shared lock on the file is acquired.
+
+    Does nothing on platforms without `fcntl` (i.e. Windows).
+    """
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _hash_requirements(requirements_files: List[str]) -> str:
+    """Return a key identifying a virtualenv for the given requirements.
+
+    The key covers the host Python, and the name, size and contents of each
+    requirements file, including files pulled in with -r/-c. Local paths the
+    requirements refer to (e.g. `-e ./pkg`, `file:` URLs) are not tracked;
+    use --refresh_venv_cache after changing them.
+    """
+    h = hashlib.sha256()
+    h.update(sys.executable.encode('utf-8'))
+    h.update(sys.version.encode('utf-8'))
+    seen = set()
+    for requirements_file in requirements_files:
+        # Top-level files are keyed by base name only, since packages are
+        # unzipped to a different temporary dir on every run.
+        for name, content in _read_requirements_files(
+                requirements_file, os.path.basename(requirements_file), seen):
+            h.update(f'{name}\0{len(content)}\0'.encode('utf-8'))
+            h.update(content)
+    return h.hexdigest()[:16]
+
+
+def _read_requirements_files(
+        path: str, name: str, seen: Set[str]
+) -> Iterator[Tuple[str, bytes]]:
+    """Yields (name, content) of a requirements file and the files it includes.
+
+    Args:
+      path: Path to the requirements file.
+      name: Name identifying the file in the hash.
+      seen: Absolute paths of files already read, to skip repeats and cycles.
+    """
+    path = os.path.abspath(path)
+    if path in seen:
+        return
+    seen.add(path)
+    with open(path, 'rb') as f:
+        content = f.read()
+    yield name, content
+    for line in content.decode('utf-8', errors='replace').splitlines():
+        match = _REQUIREMENTS_INCLUDE_PATTERN.match(line)
+        if not match or '://' in match.group(1):
+            continue
+        include_path = os.path.join(os.path.dirname(path), match.group(1))
+        if os.path.isfile(include_path):
+            yield from _read_requirements_files(
+                include_path,
+                os.path.join(os.path.dirname(name), match.group(1)),
+                seen)
+
+
+def _get_venv_executable(venv_dir: str) -> str:
+    """Return the path to the Python interpreter of a virtualenv."""
+    if platform.system() == 'Windows':
+        return os.path.join(venv_dir, 'Scripts', 'python.exe')
+    return os.path.join(venv_dir, 'bin', 'python3')
+
+
+def _create_virtualenv(venv_dir: str, requirements_files: List[str]) -> None:
+    """Creates a virtualenv at the given dir and installs dependencies."""
     _padded_print(f'Creating virtualenv at {venv_dir}.')
     subprocess.check_call([sys.executable, '-m', 'venv', venv_dir])
-    _tempdirs.append(venv_dir)
-    if platform.system() == 'Windows':
-        venv_executable = os.path.join(venv_dir, 'Scripts', 'python.exe')
-    else:
-        venv_executable = os.path.join(venv_dir, 'bin', 'python3')
+    venv_executable = _get_venv_executable(venv_dir)
 
     # Install requirements
-    for requirements_file in requirements_files:
-        print(f'Installing dependencies from {requirements_file}.')
-        subprocess.check_call(
-            [venv_executable, '-m', 'pip', 'install', '-r', requirements_file]
-        )
-    return venv_executable
+    if requirements_files:
+        print(f'Installing dependencies from {", ".join(requirements_files)}.')
+        cmd = [venv_executable, '-m', 'pip', 'install', '--no-input',
+               '--disable-pip-version-check', '--prefer-binary']
+        for requirements_file in requirements_files:
+            cmd += ['-r', requirements_file]
+        subprocess.check_call(cmd)
 
 
 def _parse_adb_devices(lines: List[str]) -> List[str]:
@@ -288,21 +559,69 @@ def _install_apks(
             ).decode('utf-8').strip().splitlines()
         )
         serials = _parse_adb_devices(adb_devices_out)
+    if not serials:
+        return
+    max_workers = min(len(serials), _MAX_INSTALL_WORKERS)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        install_futures = [
+            executor.submit(_install_apks_on_device, apks, serial)
+            for serial in serials
+        ]
+        try:
+            for future in futures.as_completed(install_futures):
+                future.result()
+        except subprocess.CalledProcessError:
+            for future in install_futures:
+                future.cancel()
+            raise
+
+
+def _install_apks_on_device(apks: List[str], serial: str) -> None:
+    """Installs given APKs to a single device.
+
+    Tries to install all APKs with a single `adb install-multi-package` call,
+    falling back to one `adb install` per APK if the command is not supported
+    by the host's platform-tools or the device.
+
+    Args:
+      apks: List of paths to APKs.
+      serial: The device serial.
+    """
+    if not apks:
+        return
+    print(f'Installing {len(apks)} APK(s) on device {serial}.')
+    cmd = ['adb', '-s', serial, 'install-multi-package', '-r', '-g', *apks]
+    result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
+    if result.returncode == 0:
+        return
+    sys.stderr.write(result.stderr)
+    if not any(marker in result.stderr.lower()
+               for marker in _UNSUPPORTED_COMMAND_MARKERS):
+        raise subprocess.CalledProcessError(
+            result.returncode, cmd, stderr=result.stderr)
+
+    print(
+        f'`adb install-multi-package` is not supported for device {serial}. '
+        'Falling back to installing APKs one by one.'
+    )
     for apk in apks:
-        for serial in serials:
-            print(f'Installing {apk} on device {serial}.')
-            subprocess.check_call(
-                ['adb', '-s', serial, 'install', '-r', '-g', apk]
-            )
+        print(f'Installing {apk} on device {serial}.')
+        subprocess.check_call(
+            ['adb', '-s', serial, 'install', '-r', '-g', apk]
+        )
 
 
-def _generate_mobly_config(serials: Optional[List[str]] = None) -> str:
+def _generate_mobly_config(
+        exit_stack: contextlib.ExitStack,
+        serials: Optional[List[str]] = None,
+) -> str:
     """Generates a Mobly config for the provided device serials.
 
     If no serials specified, generate a wildcard config (test loads all attached
     devices).
 
     Args:
+      exit_stack: ExitStack that owns the generated config file.
       serials: List of device serials.
 
     Returns:
@@ -316,11 +635,11 @@ def _generate_mobly_config(serials: Optional[List[str]] = None) -> str:
             },
         }]
     }
-    _, config_path = tempfile.mkstemp(prefix='mobly_config_')
+    fd, config_path = tempfile.mkstemp(prefix='mobly_config_')
+    exit_stack.callback(os.remove, config_path)
     _padded_print(f'Generating Mobly config at {config_path}.')
-    with open(config_path, 'w') as f:
+    with os.fdopen(fd, 'w') as f:
         json.dump(config, f)
-    _tempfiles.append(config_path)
     return config_path
 
 
@@ -329,32 +648,43 @@ def _run_mobly_tests(
         mobly_bins: List[str],
         config: str,
         test_bed: Optional[str],
-        log_path: Optional[str]
+        log_path: Optional[str],
+        parallel: bool = False,
 ) -> None:
-    """Runs the Mobly tests with the specified binary and config."""
-    env = os.environ.copy()
-    for mobly_bin in mobly_bins:
-        bin_name = os.path.basename(mobly_bin)
-        if log_path:
-            env['MOBLY_LOGPATH'] = os.path.join(log_path, bin_name)
-        cmd = [python_executable] if python_executable else []
-        cmd += [mobly_bin, '-c', config]
-        if test_bed:
-            cmd += ['-tb', test_bed]
-        _padded_print(f'Running Mobly test {bin_name}.')
-        print(f'Command: {cmd}\n')
-        subprocess.run(cmd, env=env)
-
-
-def _clean_up() -> None:
-    """Cleans up temporary directories and files."""
-    _padded_print('Cleaning up temporary directories/files.')
-    for td in _tempdirs:
-        shutil.rmtree(td, ignore_errors=True)
-    _tempdirs.clear()
-    for tf in _tempfiles:
-        os.remove(tf)
-    _tempfiles.clear()
+    """Runs the Mobly tests with the specified binary and config.
+
+    If parallel is set and a log path is given, the tests are run
+    concurrently, each logging to its own directory under log_path.
+    """
+    parallel = parallel and bool(log_path) and len(mobly_bins) > 1
+    base_env = os.environ.copy()
+    procs = []
+    try:
+        for mobly_bin in mobly_bins:
+            bin_name = os.path.basename(mobly_bin)
+            env = base_env
+            if log_path:
+                env = {**base_env,
+                       'MOBLY_LOGPATH': os.path.join(log_path, bin_name)}
+            cmd = [python_executable] if python_executable else []
+            cmd += [mobly_bin, '-c', config]
+            if test_bed:
+                cmd += ['-tb', test_bed]
+            _padded_print(f'Running Mobly test {bin_name}.')
+            print(f'Command: {cmd}\n')
+            if parallel:
+                procs.append(subprocess.Popen(cmd, env=env))
+            else:
+                subprocess.run(cmd, env=env)
+        for proc in procs:
+            proc.wait()
+    finally:
+        # Don't leave tests running against resources about to be cleaned up
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            proc.wait()
 
 
 def main() -> None:
@@ -371,30 +701,33 @@ def main() -> None:
 
     serials = args.serials.split(',') if args.serials else None
 
-    # Resolve test resources
-    mobly_bins, requirements_files, test_apks = _resolve_test_resources(args)
-
-    # Install test APKs, if necessary
-    if args.install_apks:
-        _install_apks(test_apks, serials)
-
-    # Set up the Python virtualenv, if necessary
-    python_executable = None
-    if args.novenv:
-        if args.test_paths is not None:
-            python_executable = sys.executable
-    else:
-        python_executable = _setup_virtualenv(requirements_files)
-
-    # Generate the Mobly config, if necessary
-    config = args.config or _generate_mobly_config(serials)
+    # Temporary dirs/files are cleaned up on exit, even if a step fails
+    with contextlib.ExitStack() as exit_stack:
+        # Resolve test resources
+        mobly_bins, requirements_files, test_apks = _resolve_test_resources(
+            args, exit_stack)
+
+        # Install test APKs, if necessary
+        if args.install_apks:
+            _install_apks(test_apks, serials)
+
+        # Set up the Python virtualenv, if necessary
+        python_executable = None
+        if args.novenv:
+            if args.test_paths is not None:
+                python_executable = sys.executable
+        else:
+            python_executable = _setup_virtualenv(
+                requirements_files, exit_stack,
+                use_cache=not args.novenv_cache,
+                refresh_cache=args.refresh_venv_cache)
 
-    # Run the tests
-    _run_mobly_tests(python_executable, mobly_bins, config, args.test_bed,
-                     args.log_path)
+        # Generate the Mobly config, if necessary
+        config = args.config or _generate_mobly_config(exit_stack, serials)
 
-    # Clean up temporary dirs/files
-    _clean_up()
+        # Run the tests
+        _run_mobly_tests(python_executable, mobly_bins, config, args.test_bed,
+                         args.log_path, args.parallel)
 
 
 if __name__ == '__main__':
@@ -16,28 +16,56 @@
 
 """Utility for accessing aconfig and device_config flag values on a device."""
 
+from concurrent import futures
+import hashlib
 import os
 import tempfile
-from typing import Any, Dict, Optional
+from typing import Dict, NamedTuple, Optional, Tuple
 
+from google.protobuf import message
 from mobly.controllers import android_device
+from mobly.controllers.android_device_lib import adb
 from protos import aconfig_pb2
 
 _ACONFIG_PARTITIONS = ('product', 'system', 'system_ext', 'vendor')
 _ACONFIG_PB_FILE = 'aconfig_flags.pb'
 
-_DEVICE_CONFIG_GET_CMD = 'device_config get'
+# `adb pull` error output indicating that the requested file does not exist.
+_FILE_NOT_FOUND_MARKERS = ('does not exist', 'No such file or directory')
+
+# Parsed aconfig flags are cached on the host, keyed by build fingerprint.
+_ACONFIG_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'mobly')
+_ACONFIG_CACHE_FILE = 'aconfig_%s.pb'
+
+_GET_FINGERPRINT_CMD = 'getprop ro.build.fingerprint'
+
+_DEVICE_CONFIG_LIST_CMD = 'device_config list'
+_NULL_VALUE = 'null'
+
+_EMPTY_NAMESPACE = {}
+
+_TRUE_VALUES = frozenset(('true', 'True', 'TRUE', '1'))
+_FALSE_VALUES = frozenset(('false', 'False', 'FALSE', '0'))
 
 _READ_ONLY = aconfig_pb2.flag_permission.READ_ONLY
 _ENABLED = aconfig_pb2.flag_state.ENABLED
 
 
+class _AconfigFlag(NamedTuple):
+    """The resolved value and permission of an aconfig flag."""
+    value: str
+    read_only: bool
+
+
 class DeviceFlags:
     """Provides access to aconfig and device_config flag values of a device."""
 
     def __init__(self, ad: android_device.AndroidDevice):
         self._ad = ad
         self._aconfig_flags = None
+        self._device_config_flags = {}
+        self._value_cache = {}
 
     def get_value(self, namespace: str, name: str) -> Optional[str]:
         """Gets the value of the requested flag.
@@ -46,7 +74,10 @@ class DeviceFlags:
 
         The method will first look for the flag from the device's
         aconfig_flags.pb files, and, if not found or the flag is READ_WRITE,
-        then retrieve the value from 'adb device_config get'.
+        then retrieve the value from 'adb device_config list'. The
+        device_config flags of a namespace are fetched once, and resolved
+        values are cached; call invalidate() after changing flags on the
+        device.
 
         All values are returned as strings, e.g. 'true', '3'.
 
@@ -61,20 +92,29 @@ class DeviceFlags:
         Returns:
             The flag value as a string.
         """
+        key = (namespace, name)
+        if key in self._value_cache:
+            return self._value_cache[key]
+        value = self._get_value(namespace, name)
+        self._value_cache[key] = value
+        return value
+
+    def _get_value(self, namespace: str, name: str) -> Optional[str]:
+        """Gets the value of the requested flag, bypassing the value cache."""
         # Check aconfig
         aconfig_val = None
         aconfig_flag = self._get_aconfig_flags().get(
-            '%s/%s' % (namespace, name))
+            namespace, _EMPTY_NAMESPACE).get(name)
         if aconfig_flag is not None:
-            aconfig_val = 'true' if aconfig_flag.state == _ENABLED else 'false'
-            if aconfig_flag.permission == _READ_ONLY:
+            aconfig_val = aconfig_flag.value
+            if aconfig_flag.read_only:
                 return aconfig_val
 
         # If missing or READ_WRITE, also check device_config
-        device_config_val = self._ad.adb.shell(
-            '%s %s %s' % (_DEVICE_CONFIG_GET_CMD, namespace, name)
-        ).decode('utf8').strip()
-        return device_config_val if device_config_val != 'null' else aconfig_val
+        device_config_val = self._get_device_config_flags(namespace).get(name)
+        if device_config_val is None:
+            return aconfig_val
+        return device_config_val
 
     def get_bool(self, namespace: str, name: str) -> bool:
         """Gets the value of the requested flag as a boolean.
@@ -92,32 +132,176 @@ class DeviceFlags:
             ValueError if the flag value cannot be expressed as a boolean.
         """
         val = self.get_value(namespace, name)
-        if val.lower() == 'true':
+        if val in _TRUE_VALUES:
             return True
-        if val.lower() == 'false':
+        if val in _FALSE_VALUES:
             return False
         raise ValueError('Flag %s/%s is not a boolean (value: %s).'
                          % (namespace, name, val))
 
-    def _get_aconfig_flags(self) -> Dict[str, Any]:
-        """Gets the aconfig flags as a dict. Loads from proto if necessary."""
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """Discards cached flag values.
+
+        Args:
+            namespace: The namespace to invalidate. If None, all namespaces are
+                invalidated.
+        """
+        if namespace is None:
+            self._device_config_flags.clear()
+            self._value_cache.clear()
+        else:
+            self._device_config_flags.pop(namespace, None)
+            for key in [key for key in self._value_cache
+                        if key[0] == namespace]:
+                del self._value_cache[key]
+
+    def _get_device_config_flags(self, namespace: str) -> Dict[str, str]:
+        """Gets the device_config flags of a namespace as a dict.
+
+        Fetches them from the device if necessary.
+        """
+        flags = self._device_config_flags.get(namespace)
+        if flags is None:
+            flags = self._load_device_config_flags(namespace)
+            self._device_config_flags[namespace] = flags
+        return flags
+
+    def _load_device_config_flags(self, namespace: str) -> Dict[str, str]:
+        """Lists all device_config flags of a namespace from the device."""
+        output = self._ad.adb.shell(
+            '%s %s' % (_DEVICE_CONFIG_LIST_CMD, namespace)).decode('utf8')
+        flags = {}
+        for line in output.splitlines():
+            key, sep, value = line.partition('=')
+            value = value.strip()
+            # A 'null' value means the flag is not set
+            if sep and value != _NULL_VALUE:
+                flags[key.strip()] = value
+        return flags
+
+    def _get_aconfig_flags(self) -> Dict[str, Dict[str, _AconfigFlag]]:
+        """Gets the aconfig flags as a dict. Loads from proto if necessary.
+
+        Flags are keyed by namespace, then by '{package}.{name}'.
+        """
         if self._aconfig_flags is None:
             self._load_aconfig_flags()
         return self._aconfig_flags
 
     def _load_aconfig_flags(self) -> None:
-        """Pull aconfig proto files from device, then load the flag info."""
+        """Load the flag info, from the host cache or from the device."""
         self._aconfig_flags = {}
+        cache_path = self._get_aconfig_cache_path()
+        parsed_flags = None
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path, 'rb') as f:
+                try:
+                    parsed_flags = aconfig_pb2.parsed_flags.FromString(
+                        f.read())
+                except message.DecodeError:
+                    parsed_flags = None
+        if parsed_flags is None:
+            parsed_flags, complete = self._pull_aconfig_flags()
+            # Only cache complete results, so a failed pull is retried later
+            if complete and cache_path is not None:
+                self._write_aconfig_cache(cache_path, parsed_flags)
+        for flag in parsed_flags.parsed_flag:
+            self._aconfig_flags.setdefault(flag.namespace, {})[
+                '%s.%s' % (flag.package, flag.name)] = _AconfigFlag(
+                    value='true' if flag.state == _ENABLED else 'false',
+                    read_only=flag.permission == _READ_ONLY)
+
+    def _pull_aconfig_flags(self) -> Tuple[aconfig_pb2.parsed_flags, bool]:
+        """Pull aconfig proto files from device and merge their contents.
+
+        Partitions are pulled concurrently. Partitions without a proto file,
+        or whose proto file fails to be pulled, are skipped.
+
+        Returns:
+            Tuple of (merged parsed flags, whether all existing proto files
+            were pulled).
+        """
+        parsed_flags = aconfig_pb2.parsed_flags()
+        complete = True
         with tempfile.TemporaryDirectory() as tmp_dir:
-            for partition in _ACONFIG_PARTITIONS:
-                device_path = os.path.join(
-                    '/', partition, 'etc', _ACONFIG_PB_FILE)
-                host_path = os.path.join(
-                    tmp_dir, '%s_%s' % (partition, _ACONFIG_PB_FILE))
-                self._ad.adb.pull([device_path, host_path])
+            host_paths = [
+                os.path.join(tmp_dir, '%s_%s' % (partition, _ACONFIG_PB_FILE))
+                for partition in _ACONFIG_PARTITIONS
+            ]
+            with futures.ThreadPoolExecutor(
+                    max_workers=len(_ACONFIG_PARTITIONS)) as executor:
+                pull_futures = [
+                    executor.submit(self._pull_aconfig_file, partition, path)
+                    for partition, path in zip(_ACONFIG_PARTITIONS, host_paths)
+                ]
+            for partition, host_path, future in zip(
+                    _ACONFIG_PARTITIONS, host_paths, pull_futures):
+                try:
+                    if not future.result():
+                        continue
+                except adb.AdbError as e:
+                    self._ad.log.warning(
+                        'Failed to pull aconfig flags of partition %s: %s',
+                        partition, e)
+                    complete = False
+                    continue
                 with open(host_path, 'rb') as f:
-                    parsed_flags = aconfig_pb2.parsed_flags.FromString(f.read())
-                for flag in parsed_flags.parsed_flag:
-                    full_name = '%s/%s.%s' % (
-                        flag.namespace, flag.package, flag.name)
-                    self._aconfig_flags[full_name] = flag
+                    parsed_flags.MergeFromString(f.read())
+        return parsed_flags, complete
+
+    def _pull_aconfig_file(self, partition: str, host_path: str) -> bool:
+        """Pull the aconfig proto file of a partition to the host.
+
+        Returns:
+            True if the file was pulled, False if it does not exist on the
+            device.
+
+        Raises:
+            adb.AdbError if the file exists but could not be pulled.
+        """
+        device_path = os.path.join('/', partition, 'etc', _ACONFIG_PB_FILE)
+        try:
+            self._ad.adb.pull([device_path, host_path])
+        except adb.AdbError as e:
+            stderr = e.stderr
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode('utf8', errors='replace')
+            if any(marker in stderr for marker in _FILE_NOT_FOUND_MARKERS):
+                self._ad.log.debug('%s does not exist.', device_path)
+                return False
+            raise
+        return True
+
+    def _get_aconfig_cache_path(self) -> Optional[str]:
+        """Gets the host cache path for the device's aconfig flags.
+
+        Returns:
+            The cache path, or None if the build fingerprint is unavailable.
+        """
+        fingerprint = self._ad.adb.shell(_GET_FINGERPRINT_CMD).strip()
+        if not fingerprint:
+            return None
+        key = hashlib.sha256(fingerprint).hexdigest()
+        return os.path.join(_ACONFIG_CACHE_DIR, _ACONFIG_CACHE_FILE % key)
+
+    def _write_aconfig_cache(
+            self, cache_path: str, parsed_flags: aconfig_pb2.parsed_flags
+    ) -> None:
+        """Atomically writes the parsed aconfig flags to the host cache.
+
+        The cache is an optimization, so failures are logged and ignored.
+        """
+        cache_dir = os.path.dirname(cache_path)
+        tmp_path = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    dir=cache_dir, delete=False) as f:
+                tmp_path = f.name
+                f.write(parsed_flags.SerializeToString())
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            self._ad.log.warning(
+                'Failed to cache aconfig flags at %s: %s', cache_path, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
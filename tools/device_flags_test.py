@@ -14,13 +14,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
 import unittest
 from unittest import mock
 
+from mobly.controllers.android_device_lib import adb
 from mobly.tools import device_flags
 from protos import aconfig_pb2
 
 
+def _make_parsed_flags() -> aconfig_pb2.parsed_flags:
+    """Creates a parsed_flags proto with a single sample flag."""
+    sample_flag = aconfig_pb2.parsed_flag()
+    sample_flag.namespace = 'sample'
+    sample_flag.package = 'com.android'
+    sample_flag.name = 'flag'
+    sample_flag.state = aconfig_pb2.flag_state.DISABLED
+    sample_flag.permission = aconfig_pb2.flag_permission.READ_WRITE
+    return aconfig_pb2.parsed_flags(parsed_flag=[sample_flag])
+
+
 class DeviceFlagsTest(unittest.TestCase):
     """Unit tests for DeviceFlags."""
 
@@ -30,48 +44,183 @@ class DeviceFlagsTest(unittest.TestCase):
         self.device_flags._aconfig_flags = {}
 
     def test_get_value_aconfig_flag_missing_use_device_config(self) -> None:
-        self.ad.adb.shell.return_value = b'foo'
+        self.ad.adb.shell.return_value = b'flag=foo\n'
         self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'foo')
+        self.ad.adb.shell.assert_called_once_with('device_config list sample')
 
     def test_get_value_aconfig_flag_read_write_use_device_config(self) -> None:
-        sample_flag = aconfig_pb2.parsed_flag()
-        sample_flag.state = aconfig_pb2.flag_state.ENABLED
-        sample_flag.permission = aconfig_pb2.flag_permission.READ_WRITE
-        self.device_flags._aconfig_flags['sample/flag'] = sample_flag
+        self.device_flags._aconfig_flags['sample'] = {
+            'flag': device_flags._AconfigFlag(value='true', read_only=False)}
 
-        self.ad.adb.shell.return_value = b'false'
+        self.ad.adb.shell.return_value = b'flag=false\n'
         self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'false')
 
     def test_get_value_aconfig_flag_read_only_use_aconfig(self) -> None:
-        sample_flag = aconfig_pb2.parsed_flag()
-        sample_flag.state = aconfig_pb2.flag_state.ENABLED
-        sample_flag.permission = aconfig_pb2.flag_permission.READ_ONLY
-        self.device_flags._aconfig_flags['sample/flag'] = sample_flag
+        self.device_flags._aconfig_flags['sample'] = {
+            'flag': device_flags._AconfigFlag(value='true', read_only=True)}
 
-        self.ad.adb.shell.return_value = b'false'
+        self.ad.adb.shell.return_value = b'flag=false\n'
+        self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'true')
+
+    def test_get_value_device_config_missing_use_aconfig(self) -> None:
+        self.device_flags._aconfig_flags['sample'] = {
+            'flag': device_flags._AconfigFlag(value='true', read_only=False)}
+
+        self.ad.adb.shell.return_value = b'other_flag=false\n'
         self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'true')
 
     def test_get_value_device_config_null_use_aconfig(self) -> None:
-        sample_flag = aconfig_pb2.parsed_flag()
-        sample_flag.state = aconfig_pb2.flag_state.ENABLED
-        sample_flag.permission = aconfig_pb2.flag_permission.READ_WRITE
-        self.device_flags._aconfig_flags['sample/flag'] = sample_flag
+        self.device_flags._aconfig_flags['sample'] = {
+            'flag': device_flags._AconfigFlag(value='true', read_only=False)}
 
-        self.ad.adb.shell.return_value = b'null'
+        self.ad.adb.shell.return_value = b'flag=null\n'
         self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'true')
 
+    def test_get_value_device_config_listed_once_per_namespace(self) -> None:
+        self.ad.adb.shell.return_value = b'flag1=foo\nflag2=a=b\n'
+        self.assertEqual(self.device_flags.get_value('sample', 'flag1'), 'foo')
+        self.assertEqual(self.device_flags.get_value('sample', 'flag2'), 'a=b')
+        self.assertIsNone(self.device_flags.get_value('sample', 'flag3'))
+        self.ad.adb.shell.assert_called_once_with('device_config list sample')
+
+    def test_get_value_after_invalidate_reloads_device_config(self) -> None:
+        self.ad.adb.shell.return_value = b'flag=foo\n'
+        self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'foo')
+
+        self.ad.adb.shell.return_value = b'flag=bar\n'
+        self.device_flags.invalidate('sample')
+        self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'bar')
+
+    def test_get_value_cached(self) -> None:
+        self.ad.adb.shell.return_value = b'flag=foo\n'
+        self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'foo')
+
+        self.device_flags._device_config_flags.clear()
+        self.assertEqual(self.device_flags.get_value('sample', 'flag'), 'foo')
+        self.ad.adb.shell.assert_called_once()
+
     def test_get_bool_with_valid_bool_value(self) -> None:
-        self.ad.adb.shell.return_value = b'true'
-        self.assertTrue(self.device_flags.get_bool('sample', 'flag'))
+        self.ad.adb.shell.return_value = b'flag1=true\nflag2=false\n'
+        self.assertTrue(self.device_flags.get_bool('sample', 'flag1'))
+        self.assertFalse(self.device_flags.get_bool('sample', 'flag2'))
 
-        self.ad.adb.shell.return_value = b'false'
-        self.assertFalse(self.device_flags.get_bool('sample', 'flag'))
+    def test_get_bool_with_numeric_bool_value(self) -> None:
+        self.ad.adb.shell.return_value = b'flag1=1\nflag2=0\n'
+        self.assertTrue(self.device_flags.get_bool('sample', 'flag1'))
+        self.assertFalse(self.device_flags.get_bool('sample', 'flag2'))
 
     def test_get_bool_with_invalid_bool_value(self) -> None:
-        self.ad.adb.shell.return_value = b'foo'
+        self.ad.adb.shell.return_value = b'flag=foo\n'
         with self.assertRaisesRegex(ValueError, 'not a boolean'):
             self.device_flags.get_bool('sample', 'flag')
 
+    def test_load_aconfig_flags_pulls_and_writes_cache(self) -> None:
+        parsed_flags = _make_parsed_flags()
+
+        def pull(args):
+            with open(args[1], 'wb') as f:
+                f.write(parsed_flags.SerializeToString())
+
+        self.ad.adb.shell.return_value = b'fingerprint\n'
+        self.ad.adb.pull.side_effect = pull
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.object(
+                    device_flags, '_ACONFIG_CACHE_DIR', cache_dir):
+                self.device_flags._load_aconfig_flags()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        self.assertEqual(self.ad.adb.pull.call_count,
+                         len(device_flags._ACONFIG_PARTITIONS))
+        self.assertEqual(
+            self.device_flags._aconfig_flags['sample']['com.android.flag'],
+            device_flags._AconfigFlag(value='false', read_only=False))
+
+    def test_load_aconfig_flags_missing_file_skipped_and_cached(
+            self) -> None:
+        parsed_flags = _make_parsed_flags()
+
+        def pull(args):
+            if args[0].startswith('/vendor/'):
+                raise adb.AdbError(
+                    cmd='pull', stdout=b'',
+                    stderr=b"adb: error: failed to stat remote object "
+                           b"'/vendor/etc/aconfig_flags.pb': No such file or "
+                           b"directory",
+                    ret_code=1)
+            with open(args[1], 'wb') as f:
+                f.write(parsed_flags.SerializeToString())
+
+        self.ad.adb.shell.return_value = b'fingerprint\n'
+        self.ad.adb.pull.side_effect = pull
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.object(
+                    device_flags, '_ACONFIG_CACHE_DIR', cache_dir):
+                self.device_flags._load_aconfig_flags()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        self.ad.log.warning.assert_not_called()
+        self.assertIn('com.android.flag',
+                      self.device_flags._aconfig_flags['sample'])
+
+    def test_load_aconfig_flags_failed_pull_not_cached(self) -> None:
+        parsed_flags = _make_parsed_flags()
+
+        def pull(args):
+            if args[0].startswith('/vendor/'):
+                raise adb.AdbError(
+                    cmd='pull', stdout=b'', stderr=b'device offline',
+                    ret_code=1)
+            with open(args[1], 'wb') as f:
+                f.write(parsed_flags.SerializeToString())
+
+        self.ad.adb.shell.return_value = b'fingerprint\n'
+        self.ad.adb.pull.side_effect = pull
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.object(
+                    device_flags, '_ACONFIG_CACHE_DIR', cache_dir):
+                self.device_flags._load_aconfig_flags()
+            self.assertEqual(os.listdir(cache_dir), [])
+
+        self.ad.log.warning.assert_called_once()
+        self.assertIn('com.android.flag',
+                      self.device_flags._aconfig_flags['sample'])
+
+    def test_load_aconfig_flags_cache_write_failure_ignored(self) -> None:
+        parsed_flags = _make_parsed_flags()
+
+        def pull(args):
+            with open(args[1], 'wb') as f:
+                f.write(parsed_flags.SerializeToString())
+
+        self.ad.adb.shell.return_value = b'fingerprint\n'
+        self.ad.adb.pull.side_effect = pull
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.object(
+                    device_flags, '_ACONFIG_CACHE_DIR', cache_dir), \
+                    mock.patch.object(
+                        device_flags.os, 'replace', side_effect=OSError):
+                self.device_flags._load_aconfig_flags()
+            self.assertEqual(os.listdir(cache_dir), [])
+
+        self.ad.log.warning.assert_called_once()
+        self.assertIn('com.android.flag',
+                      self.device_flags._aconfig_flags['sample'])
+
+    def test_load_aconfig_flags_uses_cache(self) -> None:
+        parsed_flags = _make_parsed_flags()
+
+        self.ad.adb.shell.return_value = b'fingerprint\n'
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.object(
+                    device_flags, '_ACONFIG_CACHE_DIR', cache_dir):
+                self.device_flags._write_aconfig_cache(
+                    self.device_flags._get_aconfig_cache_path(), parsed_flags)
+                self.device_flags._load_aconfig_flags()
+
+        self.ad.adb.pull.assert_not_called()
+        self.assertIn('com.android.flag',
+                      self.device_flags._aconfig_flags['sample'])
+
 
 if __name__ == '__main__':
     unittest.main()